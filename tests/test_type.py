@@ -313,6 +313,95 @@ class TestType(unittest.TestCase):
         y = f.apply(g)
         self.assertEqual(len(y.constraints), 0)
 
+    def test_independence_of_constrained_schema_instances(self):
+        # Instances of constrained schemas are copied from a template; they
+        # must not share variables or constraints
+        A, B, F = Type.declare('A'), Type.declare('B'), Type.declare('F', 2)
+        f = TypeSchema(lambda r, x: r ** x | r @ [F(A, x), F(B, x)])
+        self.apply(f, F(A, B), B)
+        self.apply(f, F(B, A), A)
+        self.apply(f, A, error.ConstraintViolation)
+        self.apply(f, F(A, A), A)
+
+    def test_concrete_application(self):
+        A = Type.declare('A')
+        B = Type.declare('B', supertype=A)
+        F, G = Type.declare('F', params=1), Type.declare('G', params=1)
+        self.assertTrue((F(A) ** A).is_concrete())
+        self.assertFalse(TypeSchema(lambda x: F(x) ** A).is_concrete())
+        self.apply(F(A) ** A, F(B), A)
+        self.apply(F(B) ** A, F(A), error.SubtypeMismatch)
+        self.apply(F(A) ** A, G(A), error.TypeMismatch)
+
+    def test_constrain_free_variable_via_wildcard_skeleton(self):
+        # Unifying with the skeleton of the only remaining alternative turns
+        # its wildcards into ordinary variables, which are then free
+        A, G = Type.declare('A'), Type.declare('G', params=1)
+        f = TypeSchema(lambda x: A | x @ [G(_)])
+        self.assertRaises(error.ConstrainFreeVariable, TypeSchema.instance, f)
+
+    def test_fixed_supertype(self):
+        A, B = Type.declare('A'), Type.declare('B')
+        C = Type.declare('C', supertype=A)
+        with self.assertRaises(AttributeError):
+            C.supertype = B
+        self.assertTrue(C.subtype(A))
+        self.assertFalse(C.subtype(B))
+
+    def test_constraint_description_of_schema_instances(self):
+        # Errors should mention the variables of the instance at hand, not
+        # those of the template it was copied from
+        A, B, C = Type.declare('A'), Type.declare('B'), Type.declare('C')
+        f = TypeSchema(lambda x: x ** x | x @ [A, B])
+        for _ in range(2):
+            t = f.instance()
+            name = str(t.params[0])
+            with self.assertRaises(error.ConstraintViolation) as cm:
+                t.apply(C.instance())
+            self.assertIn(f"{name} ** {name} | {name} @", str(cm.exception))
+
+        # The same goes for a reference that was unified with the skeleton of
+        # the only alternative while the template was built
+        C = Type.declare('C')
+        A = Type.declare('A', supertype=C)
+        F = Type.declare('F', params=2)
+        f = TypeSchema(lambda x, r: r ** x | r @ [F(x, A)])
+        for _ in range(2):
+            t = f.instance()
+            r, x = t.params
+            expected = f"{r} ** {x} | {r} @ [F({x}, A)]"
+            self.assertTrue(str(r).startswith("F("))
+            with self.assertRaises(error.ConstraintViolation) as cm:
+                t.apply(F(B, C).instance())
+            self.assertIn(expected, str(cm.exception))
+
+    def test_strict_subtyping_of_operators_and_schemata(self):
+        A = Type.declare('A')
+        B = Type.declare('B', supertype=A)
+        F = Type.declare('F', params=1)
+        self.assertTrue(B < A)
+        self.assertFalse(A < A)
+        self.assertFalse(A < B)
+        self.assertTrue(A > B)
+        self.assertFalse(A > A)
+        self.assertFalse(B > A)
+        f = TypeSchema(lambda: F(B))
+        self.assertTrue(f < F(A))
+        self.assertFalse(f > F(A))
+        self.assertTrue(F(A) > f)
+        self.assertFalse(F(A) < f)
+
+    def test_captured_variables_in_constrained_schema(self):
+        # Only the variables of the schema itself are fresh for every
+        # instance; variables captured from outside remain shared
+        A, B = Type.declare('A'), Type.declare('B')
+        y = TypeVar()
+        f = TypeSchema(lambda x: x ** y | x @ [A, B])
+        t1, t2 = f.instance(), f.instance()
+        self.assertIs(t1.params[1].follow(), y)
+        self.assertIs(t2.params[1].follow(), y)
+        self.assertIsNot(t1.params[0].follow(), t2.params[0].follow())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -6,7 +6,7 @@ from __future__ import annotations
 
 from enum import Enum, auto
 from abc import ABC
-from functools import reduce, partial
+from functools import partial
 from itertools import groupby, chain
 from inspect import signature, Signature, Parameter
 from typing import Optional, Dict, Callable, Union, List, Iterable, Set
@@ -106,9 +106,11 @@ class Expr(ABC):
         return self.tree()
 
     def __call__(self, *args: Union[Expr, Definition]) -> Expr:
-        return reduce(Expr.apply,
-            (e if isinstance(e, Expr) else e.instance() for e in args),
-            self)
+        result = self
+        for arg in args:
+            result = result.apply(
+                arg if isinstance(arg, Expr) else arg.instance())
+        return result
 
     def tree(self, lvl: str = "") -> str:
         """
@@ -4,16 +4,16 @@ functional programming languages, as well as Traytel et al (2011).
 """
 from __future__ import annotations
 
-from enum import Enum, auto
 from abc import ABC, abstractmethod
 from itertools import chain
 from inspect import signature
-from typing import Optional, Iterable, Union, Callable, List, Set
+from typing import Optional, Iterable, Union, Callable, List, Set, Tuple, \
+    Iterator, FrozenSet, Dict, Any
 
 from transformation_algebra import error
 
 
-class Variance(Enum):
+class Variance(object):
     """
     The variance of a type parameter indicates how subtype relations of
     compound types relate to their constituent types. For example, a function
@@ -21,10 +21,13 @@ class Variance(Enum):
     subtype α₂ → β₂ ≤ α₁ → β₁ must be just as liberal or more in what input it
     accepts, e.g. α₁ ≤ α₂) and covariant in its output parameter (it must be
     just as conservative or more in what output it produces, e.g. β₂ ≤ β₁).
+
+    Variances are plain booleans that indicate contravariance, since they are
+    consulted in the innermost loops of unification.
     """
 
-    CO = auto()
-    CONTRA = auto()
+    CO = False
+    CONTRA = True
 
 
 class Type(ABC):
@@ -33,6 +36,8 @@ class Type(ABC):
     and type instances.
     """
 
+    __slots__ = ()
+
     def __repr__(self) -> str:
         return str(self)
 
@@ -74,17 +79,19 @@ class Type(ABC):
             ))
 
     def __lt__(self, other: Type) -> Optional[bool]:
-        return not self.unifiable(other) and self <= other
+        return not self.instance().unifiable(other.instance()) and \
+            self <= other
 
     def __gt__(self, other: Type) -> Optional[bool]:
-        return not self.unifiable(other) and self >= other
+        return not self.instance().unifiable(other.instance()) and \
+            self >= other
 
     def __le__(self, other: Type) -> Optional[bool]:
         return self.instance().unifiable(other.instance(),
             accept_wildcard=True, subtype=True)
 
     def __ge__(self, other: Type) -> Optional[bool]:
-        return self.instance().unifiable(other.instance(),
+        return other.instance().unifiable(self.instance(),
             accept_wildcard=True, subtype=True)
 
     def apply(self, arg: Type) -> TypeInstance:
@@ -99,7 +106,14 @@ class Type(ABC):
             f.bind(Function(TypeVar(), TypeVar()))
             f = f.follow()
 
-        if isinstance(f, TypeOperation) and f.operator == Function:
+        if isinstance(f, TypeOperation) and f.operator is Function:
+            # Fast path for concrete arguments: nothing to unify, so only a
+            # subtype check is needed. Mismatches go the long way around, to
+            # get the appropriate error
+            if x.is_concrete() and f.params[0].is_concrete() and \
+                    x.unifiable(f.params[0], subtype=True):
+                return f.params[1].resolve()
+
             x.unify(f.params[0], subtype=True)
             f.resolve()
             return f.params[1].resolve()
@@ -111,7 +125,13 @@ class Type(ABC):
         Does this type represent a function?
         """
         t = self.instance()
-        return isinstance(t, TypeOperation) and t.operator == Function
+        return isinstance(t, TypeOperation) and t.operator is Function
+
+    def is_concrete(self) -> bool:
+        """
+        Is this type free of type variables?
+        """
+        return next(self.instance().variables_iter(), None) is None
 
     @abstractmethod
     def instance(self) -> TypeInstance:
@@ -120,15 +140,15 @@ class Type(ABC):
     @staticmethod
     def declare(
             name: str,
-            params: Union[int, Iterable[Variance]] = 0,
+            params: Union[int, Iterable[bool]] = 0,
             supertype: Optional[TypeOperator] = None) -> TypeOperator:
         """
         Convenience function for defining a type.
         """
         if isinstance(params, int):
-            variance = list(Variance.CO for _ in range(params))
+            variance = (Variance.CO,) * params
         else:
-            variance = list(params)
+            variance = tuple(params)
         return TypeOperator(name=name, params=variance, supertype=supertype)
 
 
@@ -138,17 +158,55 @@ class TypeSchema(Type):
     is, a type containing some schematic type variable.
     """
 
+    __slots__ = ('schema', 'names', 'n', 'template', 'constrained',
+        'captured', 'description')
+
     def __init__(self, schema: Callable[..., TypeInstance]):
+        # Inspecting the signature is slow, so it is done only once
         self.schema = schema
-        self.n = len(signature(schema).parameters)
+        self.names: Tuple[str, ...] = tuple(signature(schema).parameters)
+        self.n = len(self.names)
+        self.template: Optional[TypeInstance] = None
+        self.constrained = False
+        self.captured: List[TypeVar] = []
+        self.description: Optional[str] = None
 
     def __str__(self) -> str:
-        return self.schema(
-            *(TypeVar(v) for v in signature(self.schema).parameters)
-        ).resolve().str_with_constraints()
+        # The schema never changes, so neither does its representation
+        if self.description is None:
+            self.description = self.schema(
+                *(TypeVar(v) for v in self.names)
+            ).resolve().str_with_constraints()
+        return self.description
 
     def instance(self) -> TypeInstance:
-        return self.schema(*(TypeVar() for _ in range(self.n)))
+        # Checking constraints is expensive, so for constrained schemas, the
+        # schema is evaluated only once into a template that is never handed
+        # out. Every instance is then a copy of that template with fresh
+        # variables. Unconstrained schemas are cheaper to simply re-evaluate.
+        if self.template is None:
+            self.template = self.schema(
+                *[TypeVar() for _ in range(self.n)]).instance()
+            self.constrained = any(
+                v.constraints for v in self.template.variables())
+
+            # Only variables that the schema creates should be copied. Those
+            # that the schema captures from outside show up in every
+            # evaluation, so a second one is enough to find them
+            if self.constrained:
+                a = self.template.reachable()
+                b = self.schema(
+                    *[TypeVar() for _ in range(self.n)]).instance().reachable()
+                self.captured = [v for k, v in a.items() if k in b]
+
+        if self.constrained:
+            memo: Dict[int, Any] = {id(v): v for v in self.captured}
+            result = self.template.fresh(memo)
+            for obj in memo.values():
+                if isinstance(obj, Constraint):
+                    obj.describe()
+            return result
+        return self.schema(*[TypeVar() for _ in range(self.n)])
 
 
 class TypeOperator(Type):
@@ -157,19 +215,31 @@ class TypeOperator(Type):
     the corresponding type operation (that is, a base type).
     """
 
+    __slots__ = ('name', '_supertype', 'variance', 'arity', '_ancestors')
+
     def __init__(
             self,
             name: str,
-            params: List[Variance] = (),
+            params: Iterable[bool] = (),
             supertype: Optional[TypeOperator] = None):
         self.name = name
-        self.supertype: Optional[TypeOperator] = supertype
-        self.variance = params
-        self.arity = len(params)
+        self._supertype = supertype
+        self.variance: Tuple[bool, ...] = tuple(params)
+        self.arity = len(self.variance)
 
         if self.supertype and self.arity > 0:
             raise ValueError("only nullary types can have direct supertypes")
 
+        # The supertype lattice is fixed at declaration, so the transitive
+        # closure of supertypes can be computed once and for all
+        self._ancestors: FrozenSet[TypeOperator] = frozenset((self,)).union(
+            supertype._ancestors if supertype else ())
+
+    @property
+    def supertype(self) -> Optional[TypeOperator]:
+        # Read-only, since the closure of supertypes depends on it
+        return self._supertype
+
     def __str__(self) -> str:
         return self.name
 
@@ -178,8 +248,7 @@ class TypeOperator(Type):
 
     def subtype(self, other: TypeOperator, strict: bool = False) -> bool:
         assert isinstance(other, TypeOperator)
-        return ((not strict and self == other) or
-            bool(self.supertype and self.supertype.subtype(other)))
+        return (not strict or self is not other) and other in self._ancestors
 
     def instance(self) -> TypeInstance:
         return TypeOperation(self)
@@ -192,6 +261,8 @@ class TypeInstance(Type):
     2-ary type operators.
     """
 
+    __slots__ = ()
+
     def str_with_constraints(self) -> str:
         """
         Like str(), but includes constraints.
@@ -214,24 +285,34 @@ class TypeInstance(Type):
         Obtain a version of this type with all eligible variables with subtype
         constraints resolved to their most specific type.
         """
-        a = self.follow()
-
-        if isinstance(a, TypeOperation):
-            for v, p in zip(a.operator.variance, a.params):
-                p.resolve(prefer_lower ^ (v == Variance.CONTRA))
-        elif isinstance(a, TypeVar):
-            if prefer_lower and a.lower:
-                a.bind(a.lower())
-            elif not prefer_lower and a.upper:
-                a.bind(a.upper())
-        return a.follow()
+        stack: List[Tuple[TypeInstance, bool]] = [(self, prefer_lower)]
+        while stack:
+            t, lower = stack.pop()
+            a = t.follow()
+            if isinstance(a, TypeOperation) and a.operator is Function:
+                stack.append((a.params[1], lower))
+                stack.append((a.params[0], not lower))
+            elif isinstance(a, TypeOperation):
+                stack.extend(reversed([
+                    (p, lower ^ v)
+                    for v, p in zip(a.operator.variance, a.params)]))
+            elif isinstance(a, TypeVar):
+                if lower and a.lower:
+                    a.bind(a.lower())
+                elif not lower and a.upper:
+                    a.bind(a.upper())
+        return self.follow()
 
     def __contains__(self, value: TypeInstance) -> bool:
-        a = self.follow()
         b = value.follow()
-        return a.unifiable(b) is True or (
-            isinstance(a, TypeOperation) and
-            any(b in t for t in a.params))
+        stack: List[TypeInstance] = [self]
+        while stack:
+            a = stack.pop().follow()
+            if a is b or a.unifiable(b) is True:
+                return True
+            elif isinstance(a, TypeOperation):
+                stack.extend(a.params)
+        return False
 
     def variables(self) -> Set[TypeVar]:
         """
@@ -245,25 +326,97 @@ class TypeInstance(Type):
                     result.add(v1)
         return result
 
-    def variables_iter(self) -> Iterable[TypeVar]:
+    def variables_iter(self) -> Iterator[TypeVar]:
         """
         Obtain an iterator of variables in this type instance, excluding
         variables that might occur in constraints, with possible repetitions.
         """
-        a = self.follow()
-        if isinstance(a, TypeVar):
-            yield a
-        elif isinstance(a, TypeOperation):
-            for v in chain(*(t.variables_iter() for t in a.params)):
-                yield v
+        stack: List[TypeInstance] = [self]
+        while stack:
+            a = stack.pop().follow()
+            if isinstance(a, TypeVar):
+                yield a
+            elif isinstance(a, TypeOperation):
+                stack.extend(reversed(a.params))
 
     def follow(self) -> TypeInstance:
         """
         Follow a unification until bumping into a type that is not yet bound.
+        Along the way, compress the path: every intermediate variable is
+        rebound directly to the end of the chain, so that subsequent calls
+        need not walk it again.
         """
-        if isinstance(self, TypeVar) and self.unified:
-            return self.unified.follow()
-        return self
+        a: TypeInstance = self
+        while isinstance(a, TypeVar) and a.unified:
+            a = a.unified
+
+        t: TypeInstance = self
+        while isinstance(t, TypeVar) and t.unified and t.unified is not a:
+            t.unified, t = a, t.unified
+        return a
+
+    def fresh(self, memo: Dict[int, Any]) -> TypeInstance:
+        """
+        A copy in which all variables, including those occurring in
+        constraints, are substituted with fresh variables with the same
+        bounds. The memo maps the identities of original objects to their
+        copies, so that shared structure remains shared. Variables that
+        should not be copied can be mapped to themselves beforehand.
+        """
+        if isinstance(self, TypeOperation):
+            # Base types contain nothing to substitute and are never mutated,
+            # so they may be shared
+            if self.basic:
+                return self
+            return TypeOperation(
+                self.operator, *[p.fresh(memo) for p in self.params])
+        else:
+            assert isinstance(self, TypeVar)
+            try:
+                return memo[id(self)]
+            except KeyError:
+                pass
+            v = TypeVar(self._name, self.wildcard)
+            memo[id(self)] = v
+            v.lower = self.lower
+            v.upper = self.upper
+            if self.unified:
+                v.unified = self.unified.fresh(memo)
+            if self.constraints:
+                try:
+                    v.constraints = memo[id(self.constraints)]
+                except KeyError:
+                    v.constraints = memo[id(self.constraints)] = set()
+                    v.constraints.update(
+                        c.fresh(memo) for c in self.constraints)
+            return v
+
+    def reachable(self) -> Dict[int, TypeVar]:
+        """
+        Obtain all variables that can be reached from this type instance,
+        including bound variables and variables occurring in constraints,
+        keyed by their identity.
+        """
+        result: Dict[int, TypeVar] = {}
+        seen: Set[Constraint] = set()
+        stack: List[TypeInstance] = [self]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, TypeOperation):
+                stack.extend(t.params)
+            elif isinstance(t, TypeVar) and id(t) not in result:
+                result[id(t)] = t
+                if t.unified:
+                    stack.append(t.unified)
+                for c in t.constraints - seen:
+                    seen.add(c)
+                    stack.append(c.reference)
+                    stack.extend(c.alternatives)
+                    if c.skeleton:
+                        stack.append(c.skeleton)
+                    if c.context:
+                        stack.append(c.context)
+        return result
 
     def skeleton(self) -> TypeInstance:
         """
@@ -292,19 +445,34 @@ class TypeInstance(Type):
         a = self.follow()
         b = other.follow()
 
+        if a is b:
+            return True
+
         if isinstance(a, TypeOperation) and isinstance(b, TypeOperation):
             if a.basic:
                 if subtype:
                     return a.operator.subtype(b.operator)
                 else:
-                    return a.operator == b.operator
-            elif a.operator != b.operator:
+                    return a.operator is b.operator
+            elif a.operator is not b.operator:
                 return False
+            elif a.operator is Function:
+                # Functions are by far the most common compound type, so
+                # they get a fast path that avoids the loop over variances
+                r1 = TypeInstance.unifiable(b.params[0], a.params[0],
+                    subtype=subtype, accept_wildcard=accept_wildcard)
+                if r1 is False:
+                    return False
+                r2 = TypeInstance.unifiable(a.params[1], b.params[1],
+                    subtype=subtype, accept_wildcard=accept_wildcard)
+                if r2 is False:
+                    return False
+                return None if r1 is None or r2 is None else True
             else:
                 result: Optional[bool] = True
                 for v, s, t in zip(a.operator.variance, a.params, b.params):
                     r = TypeInstance.unifiable(
-                        *((s, t) if v == Variance.CO else (t, s)),
+                        *((t, s) if v else (s, t)),
                         subtype=subtype,
                         accept_wildcard=accept_wildcard)
                     if r is False:
@@ -348,15 +516,17 @@ class TypeInstance(Type):
             if a.basic:
                 if subtype and not a.operator.subtype(b.operator):
                     raise error.SubtypeMismatch(a, b)
-                elif not subtype and a.operator != b.operator:
+                elif not subtype and a.operator is not b.operator:
                     raise error.TypeMismatch(a, b)
-            elif a.operator == b.operator:
+            elif a.operator is Function and b.operator is Function:
+                b.params[0].unify(a.params[0], subtype=subtype)
+                a.params[1].unify(b.params[1], subtype=subtype)
+            elif a.operator is b.operator:
                 for v, x, y in zip(a.operator.variance, a.params, b.params):
-                    if v == Variance.CO:
-                        x.unify(y, subtype=subtype)
-                    else:
-                        assert v == Variance.CONTRA
+                    if v:
                         y.unify(x, subtype=subtype)
+                    else:
+                        x.unify(y, subtype=subtype)
             else:
                 raise error.TypeMismatch(a, b)
 
@@ -396,6 +566,8 @@ class TypeOperation(TypeInstance):
     An instance of an n-ary type constructor.
     """
 
+    __slots__ = ('operator', 'params')
+
     def __init__(self, op: TypeOperator, *params: TypeInstance):
         self.operator = op
         self.params = list(params)
@@ -408,9 +580,9 @@ class TypeOperation(TypeInstance):
             )
 
     def __str__(self) -> str:
-        if self.operator == Function:
+        if self.operator is Function:
             inT, outT = self.params
-            if isinstance(inT, TypeOperation) and inT.operator == Function:
+            if isinstance(inT, TypeOperation) and inT.operator is Function:
                 return f"({inT}) ** {outT}"
             return f"{inT} ** {outT}"
         elif self.params:
@@ -419,7 +591,24 @@ class TypeOperation(TypeInstance):
             return str(self.operator)
 
     def __eq__(self, other: object) -> bool:
-        return isinstance(other, TypeInstance) and bool(self.unifiable(other))
+        # Equivalent to bool(self.unifiable(other)), but walks the structure
+        # iteratively rather than recursively
+        if not isinstance(other, TypeInstance):
+            return False
+        stack: List[Tuple[TypeInstance, TypeInstance]] = [(self, other)]
+        while stack:
+            s, t = stack.pop()
+            a, b = s.follow(), t.follow()
+            if isinstance(a, TypeOperation) and isinstance(b, TypeOperation):
+                if a.operator is not b.operator:
+                    return False
+                stack.extend(zip(a.params, b.params))
+            elif isinstance(a, TypeVar) and isinstance(b, TypeVar):
+                if not (a is b or (a.wildcard and b.wildcard)):
+                    return False
+            else:
+                return False
+        return True
 
     @property
     def basic(self) -> bool:
@@ -431,6 +620,9 @@ class TypeVar(TypeInstance):
     A type variable. This is not a schematic variable — it is instantiated!
     """
 
+    __slots__ = ('_name', 'wildcard', 'unified', 'lower', 'upper',
+        'constraints')
+
     def __init__(self, name: Optional[str] = None, wildcard: bool = False):
         self._name = name
         self.wildcard = wildcard
@@ -539,14 +731,20 @@ class Constraint(object):
     alternatives.
     """
 
+    __slots__ = ('reference', 'alternatives', 'context', 'description',
+        'skeleton', 'settled')
+
     def __init__(
             self,
             reference: TypeInstance,
             *alternatives: TypeInstance):
         self.reference = reference
         self.alternatives = list(alternatives)
-        self.description = str(self)
+        self.context: Optional[TypeInstance] = None
+        self.description = ""
+        self.describe()
         self.skeleton: Optional[TypeInstance] = None
+        self.settled = False
 
         # Inform variables about the constraint present on them
         for v in self.variables():
@@ -558,8 +756,39 @@ class Constraint(object):
     def __str__(self) -> str:
         return f"{self.reference} @ {self.alternatives}"
 
+    def fresh(self, memo: Dict[int, Any]) -> Constraint:
+        """
+        A copy of this constraint in terms of fresh variables. See
+        `TypeInstance.fresh`. The variables may not be fully copied until the
+        copy is complete, so the description of the copy is left for the
+        caller to render with `describe()`.
+        """
+        try:
+            return memo[id(self)]
+        except KeyError:
+            pass
+
+        # Bypass the constructor: the original has already been checked
+        new = memo[id(self)] = Constraint.__new__(Constraint)
+        new.reference = self.reference.fresh(memo)
+        new.alternatives = [t.fresh(memo) for t in self.alternatives]
+        new.skeleton = self.skeleton and self.skeleton.fresh(memo)
+        new.settled = self.settled
+        new.context = self.context and self.context.fresh(memo)
+        new.description = ""
+        return new
+
+    def describe(self) -> None:
+        """
+        Take a snapshot of the current state of this constraint, to be used in
+        error messages.
+        """
+        self.description = f"{self.context} | {self}" if self.context \
+            else str(self)
+
     def set_context(self, context: TypeInstance) -> None:
-        self.description = f"{context} | {self}"
+        self.context = context
+        self.describe()
 
     def variables(self) -> Set[TypeVar]:
         result = self.reference.variables()
@@ -598,6 +827,11 @@ class Constraint(object):
         fulfilled and need not be enforced any longer.
         """
 
+        # A constraint that has been fulfilled once stays fulfilled, so there
+        # is no need to check it again for every variable it is attached to
+        if self.settled:
+            return True
+
         # TODO Minimization is expensive and it is performed on every variable
         # binding. Make this more efficient?
         self.minimize()
@@ -620,12 +854,13 @@ class Constraint(object):
 
         # Fulfillment is achieved if the reference is fully concrete and there
         # is at least one definitely compatible alternative
-        return (not any(self.reference.variables()) and any(compatibility)) or \
-            self.reference in self.alternatives
+        self.settled = (not any(self.reference.variables())
+            and any(compatibility)) or self.reference in self.alternatives
+        return self.settled
 
 
 "The special constructor for function types."
-Function = TypeOperator('Function', params=[Variance.CONTRA, Variance.CO])
+Function = TypeOperator('Function', params=(Variance.CONTRA, Variance.CO))
 
 "A wildcard: fresh variable, unrelated to, and matchable with, anything else."
 _ = TypeSchema(lambda: TypeVar(wildcard=True))
@@ -634,7 +869,7 @@ _ = TypeSchema(lambda: TypeVar(wildcard=True))
 def operators(
         *ops: TypeOperator,
         param: Optional[Type] = None,
-        at: int = None) -> List[TypeInstance]:
+        at: Optional[int] = None) -> List[TypeInstance]:
     """
     Generate a list of instances of type operations. Optionally, the generated
     type operations must contain a certain parameter (at some index, if given).